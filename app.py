@@ -1,13 +1,26 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
+from flask import Flask, Response, request, jsonify, send_from_directory, render_template_string, stream_with_context, g
 import json
+import orjson
 from flask_cors import CORS
 import os
 import sqlite3
+import hashlib
 import PyPDF2
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # Fall back to PyPDF2 when the native PDFium bindings are unavailable
+    pdfium = None
 import uuid
+import time
+import functools
 from datetime import datetime
+import mmap
 import threading
+import multiprocessing
+import queue
 import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from werkzeug.utils import secure_filename
 from pathlib import Path
 
@@ -18,7 +31,12 @@ CORS(app)
 UPLOAD_FOLDER = 'uploads'
 DATABASE = 'documents.db'
 ALLOWED_EXTENSIONS = {'pdf'}
+ALLOWED_SUFFIXES = tuple(f'.{ext}' for ext in ALLOWED_EXTENSIONS)
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+# Oversized uploads are refused before they are read; the headroom covers multipart overhead
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE + 1024 * 1024
+USE_X_SENDFILE = False  # Set to True behind a server that honours X-Sendfile to serve PDFs from the kernel
+app.config['USE_X_SENDFILE'] = USE_X_SENDFILE
 
 # Cloud Storage Configuration (optional)
 USE_CLOUD_STORAGE = False  # Set to True to enable cloud storage
@@ -32,6 +50,30 @@ BACKUP_FOLDER = 'backups'
 BACKUP_RETENTION_DAYS = 30  # Keep backups for 30 days
 AUTO_BACKUP_ON_UPLOAD = True  # Create backup automatically when files are uploaded
 
+# Text Extraction Configuration
+EXTRACT_WORKERS = os.cpu_count() or 1
+PARALLEL_EXTRACT_MIN_PAGES = 32  # Split larger PDFs into page ranges extracted in parallel
+EXTRACT_TIME_BUDGET = 120  # Seconds spent extracting a document (or page range) before the rest is skipped
+EXTRACT_HARD_TIMEOUT = EXTRACT_TIME_BUDGET + 30  # Seconds before a worker process stuck inside a single page is killed
+
+# Database Configuration
+DB_POOL_SIZE = 8  # Idle connections kept open for reuse across requests
+WRITE_QUEUE_SIZE = 4  # Extracted documents waiting for the index writer
+
+# Search Index Configuration
+FTS_MERGE_PAGES = 500  # Pages of incremental segment merging done after each indexed document
+FTS_OPTIMIZE_EVERY = 50  # Fully merge the index after this many indexed documents
+MAINTENANCE_INTERVAL = 24 * 60 * 60  # Seconds between full index optimizes and ANALYZE runs
+
+SEARCH_TOTAL_CAP = 1000  # Matching documents counted at most when reporting search totals
+SEARCH_LOG_MAX_ROWS = 10000  # Oldest search log entries beyond this are trimmed
+SEARCH_LOG_FLUSH_INTERVAL = 5  # Seconds search log entries may wait in memory before being written
+
+# Characters stripped from search queries before they are split into terms
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+# The same filter as a translate table, for the common case of ASCII queries
+_NON_WORD_ASCII_TABLE = {c: ' ' for c in range(128) if _NON_WORD_RE.match(chr(c))}
+
 # Ensure upload directory exists
 Path(UPLOAD_FOLDER).mkdir(exist_ok=True)
 
@@ -39,12 +81,134 @@ Path(UPLOAD_FOLDER).mkdir(exist_ok=True)
 if ENABLE_BACKUPS:
     Path(BACKUP_FOLDER).mkdir(exist_ok=True)
 
-def get_db():
-    """Establishes a database connection."""
-    conn = sqlite3.connect(DATABASE)
+def connect_db():
+    """Opens a new database connection with the shared SQLite settings."""
+    conn = sqlite3.connect(DATABASE, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    # Only takes effect when the database file is first created
+    conn.execute('PRAGMA page_size=8192')
+    # WAL lets searches keep reading while the background indexer writes
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-65536')  # 64MB page cache
+    conn.execute('PRAGMA mmap_size=268435456')  # Read up to 256MB of the file via mmap
+    conn.execute('PRAGMA temp_store=MEMORY')
     return conn
 
+_db_pool = queue.Queue(maxsize=DB_POOL_SIZE)
+
+def acquire_db():
+    """Takes an idle connection from the pool, opening a new one if none is free."""
+    try:
+        return _db_pool.get_nowait()
+    except queue.Empty:
+        return connect_db()
+
+def release_db(conn):
+    """Returns a connection to the pool, closing it if the pool is already full."""
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _db_pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+def get_extract_pool():
+    """Returns the shared process pool used for text extraction, creating it on first use."""
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            # Forking a process that already runs the writer and request threads can copy
+            # held locks into the children, so workers are started from a clean process
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context(start_method)
+            )
+        return _extract_pool
+
+def reset_extract_pool():
+    """Discards the shared extraction pool so the next get_extract_pool call starts a fresh one."""
+    global _extract_pool
+    with _extract_pool_lock:
+        pool, _extract_pool = _extract_pool, None
+    if pool is None:
+        return
+    # shutdown() never interrupts a running job, so workers still stuck in a page are killed
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+# Version counter for cached API responses, bumped whenever documents change
+_data_version = 0
+_data_version_lock = threading.Lock()
+_response_cache = {}
+_PROCESS_TOKEN = uuid.uuid4().hex[:8]  # Keeps ETags from different processes distinct
+
+def bump_data_version():
+    """Invalidates cached API responses after a change to the underlying data."""
+    global _data_version
+    with _data_version_lock:
+        _data_version += 1
+        _response_cache.clear()
+
+def cached_response(ttl=None):
+    """Serves a GET endpoint with an ETag tied to the data version.
+    
+    Clients presenting a matching If-None-Match get a 304 without any SQL being run,
+    and non-streamed bodies are kept in memory until the data changes. With a ttl,
+    the ETag also rolls over every ttl seconds for time-dependent responses.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = f'"{_PROCESS_TOKEN}-v{_data_version}'
+            if ttl:
+                etag += f'-t{int(time.time() // ttl)}'
+            etag += '"'
+            
+            if request.headers.get('If-None-Match') == etag:
+                return Response(status=304, headers={'ETag': etag})
+            
+            # One entry per view, so ttl rollovers replace the stale body instead of piling up
+            cached = _response_cache.get(view.__name__)
+            if cached is not None and cached[0] == etag:
+                _, body, mimetype = cached
+                response = Response(body, mimetype=mimetype)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    _response_cache[view.__name__] = (etag, response.get_data(), response.mimetype)
+            
+            response.headers['ETag'] = etag
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def orjson_response(data, status=200):
+    """Builds a JSON response with orjson, which encodes much faster than jsonify."""
+    return Response(orjson.dumps(data), status=status, mimetype='application/json')
+
+def get_db():
+    """Returns the database connection for the current request, opening it on first use."""
+    db = getattr(g, '_database', None)
+    if db is None:
+        db = g._database = acquire_db()
+    return db
+
+@app.teardown_appcontext
+def close_db(exception):
+    """Returns the request's database connection to the pool, if one was taken."""
+    db = g.pop('_database', None)
+    if db is not None:
+        release_db(db)
+
 def load_backup_config():
     """Load backup configuration from file."""
     global BACKUP_FOLDER
@@ -63,7 +227,7 @@ def load_backup_config():
 
 def init_database():
     """Initialize the SQLite database."""
-    conn = get_db()
+    conn = connect_db()
     cursor = conn.cursor()
     
     # Create documents table
@@ -81,15 +245,78 @@ def init_database():
         )
     ''')
     
-    # Create FTS5 table for searchable content
+    # Add the content hash column to databases created before upload deduplication
+    cursor.execute("PRAGMA table_info(documents)")
+    if 'content_hash' not in [column['name'] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+    
+    # Indexes for the status filters and date ordering used by search and stats
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doc_status_date ON documents(status, upload_date DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doc_upload_date ON documents(upload_date DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doc_type ON documents(document_type) WHERE status = 'indexed'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doc_content_hash ON documents(content_hash)")
+    # Covers every column /api/stats reads, so its aggregates never touch the table rows
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doc_stats ON documents(status, document_type, page_count, upload_date)")
+    
+    # Page text lives in a plain table, which the FTS5 index reads through as its
+    # external content. Only the page text is tokenized; the id and page number
+    # are read from the content table but kept out of the index.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_content (
+            id INTEGER PRIMARY KEY,
+            document_id TEXT NOT NULL,
+            page_number INTEGER,
+            content TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_content_document ON document_content(document_id, page_number)")
+    
+    cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'document_content_fts'")
+    existing_fts = cursor.fetchone()
+    migrate_fts = existing_fts is not None and "content='document_content'" not in existing_fts[0]
+    if migrate_fts:
+        # Migrate databases whose FTS5 table stored the page text itself
+        print("Migrating search index to an external-content FTS5 table...")
+        cursor.execute('''
+            INSERT INTO document_content (document_id, page_number, content)
+            SELECT document_id, page_number, content FROM document_content_fts
+        ''')
+        cursor.execute("DROP TABLE document_content_fts")
+    
     cursor.execute('''
         CREATE VIRTUAL TABLE IF NOT EXISTS document_content_fts USING fts5(
-            document_id, 
-            page_number, 
-            content, 
-            tokenize='porter'
+            document_id UNINDEXED,
+            page_number UNINDEXED,
+            content,
+            content='document_content',
+            content_rowid='id',
+            tokenize='porter unicode61'
         )
     ''')
+    if migrate_fts:
+        cursor.execute("INSERT INTO document_content_fts(document_content_fts) VALUES ('rebuild')")
+    
+    # Keep the index in step with the content table
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS document_content_ai AFTER INSERT ON document_content BEGIN
+            INSERT INTO document_content_fts (rowid, document_id, page_number, content)
+            VALUES (new.id, new.document_id, new.page_number, new.content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS document_content_ad AFTER DELETE ON document_content BEGIN
+            INSERT INTO document_content_fts (document_content_fts, rowid, document_id, page_number, content)
+            VALUES ('delete', old.id, old.document_id, old.page_number, old.content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS document_content_au AFTER UPDATE ON document_content BEGIN
+            INSERT INTO document_content_fts (document_content_fts, rowid, document_id, page_number, content)
+            VALUES ('delete', old.id, old.document_id, old.page_number, old.content);
+            INSERT INTO document_content_fts (rowid, document_id, page_number, content)
+            VALUES (new.id, new.document_id, new.page_number, new.content);
+        END
+    ''')
     
     # Create search_logs table
     cursor.execute('''
@@ -100,14 +327,27 @@ def init_database():
             search_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_search_logs_date ON search_logs(search_date)")
+    
+    conn.commit()
     
+    # Refresh planner statistics so the indexes above are picked up
+    cursor.execute("ANALYZE")
     conn.commit()
     conn.close()
     print("Database initialized successfully")
 
 def allowed_file(filename):
     """Checks if the file extension is allowed."""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return filename.lower().endswith(ALLOWED_SUFFIXES)
+
+def hash_file(file_path):
+    """Computes a BLAKE2b digest of a file's contents, reading it in 1MB chunks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 def upload_to_cloud(file_path, file_id, original_filename):
     """Upload file to cloud storage (placeholder for cloud integration)."""
@@ -202,27 +442,120 @@ def backup_database():
         return False, str(e)
 
 def extract_text_from_pdf(file_path):
-    """Extract text from PDF file."""
+    """Extract text from PDF file.
+    
+    Returns the pages with text, the document's page count and the number of
+    pages read, which is lower than the page count if the time budget ran out.
+    """
+    for attempt in range(2):
+        try:
+            if pdfium is not None:
+                return extract_text_pdfium(file_path)
+            # PyPDF2 parses in pure Python, so it runs in a worker process to keep the
+            # GIL free for request threads while a document is being parsed
+            return get_extract_pool().submit(extract_text_pypdf2, file_path).result(timeout=EXTRACT_HARD_TIMEOUT)
+        except TimeoutError:
+            # The time budget is only checked between pages, so a worker hung inside one
+            # page never returns; kill it rather than block every queued upload behind it
+            print(f"Text extraction timed out after {EXTRACT_HARD_TIMEOUT} seconds")
+            reset_extract_pool()
+            return [], 0, 0
+        except BrokenProcessPool as e:
+            # A worker died, e.g. PDFium crashing on a malformed page, which breaks the
+            # whole pool; replace it so later documents are unaffected, and retry once
+            print(f"Extraction worker died: {str(e)}")
+            reset_extract_pool()
+        except Exception as e:
+            print(f"Error extracting text from PDF: {str(e)}")
+            return [], 0, 0
+    return [], 0, 0
+
+def extract_text_pdfium(file_path):
+    """Extract text using PDFium, which parses content streams in native code."""
+    pdf = pdfium.PdfDocument(file_path)
     try:
-        text_content = []
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page_num, page in enumerate(pdf_reader.pages):
-                text = page.extract_text()
-                if text and text.strip():
-                    text_content.append({
-                        'page': page_num + 1,
-                        'text': text.strip()
-                    })
-        return text_content, len(pdf_reader.pages)
-    except Exception as e:
-        print(f"Error extracting text from PDF: {str(e)}")
-        return [], 0
+        page_count = len(pdf)
+        if page_count < PARALLEL_EXTRACT_MIN_PAGES or EXTRACT_WORKERS < 2:
+            # Small documents are read from the already open handle
+            text_content, pages_read = read_pdfium_pages(pdf, 0, page_count)
+            return text_content, page_count, pages_read
+    finally:
+        pdf.close()
+    
+    # PDFium is not thread-safe, so large documents are split into page
+    # ranges that are extracted in separate processes
+    chunk_size = -(-page_count // EXTRACT_WORKERS)
+    starts = list(range(0, page_count, chunk_size))
+    stops = [min(start + chunk_size, page_count) for start in starts]
+    pool = get_extract_pool()
+    text_content = []
+    pages_read = 0
+    chunks = pool.map(extract_pages_pdfium, [file_path] * len(starts), starts, stops, timeout=EXTRACT_HARD_TIMEOUT)
+    for chunk, chunk_pages_read in chunks:
+        text_content.extend(chunk)
+        pages_read += chunk_pages_read
+    return text_content, page_count, pages_read
+
+def extract_pages_pdfium(file_path, start, stop):
+    """Extract text from pages [start, stop) of a PDF file using PDFium."""
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        return read_pdfium_pages(pdf, start, stop)
+    finally:
+        pdf.close()
+
+def read_pdfium_pages(pdf, start, stop):
+    """Extract text from pages [start, stop) of an open PDFium document.
+    
+    Returns the pages with text and the number of pages read before the time budget ran out.
+    """
+    text_content = []
+    deadline = time.monotonic() + EXTRACT_TIME_BUDGET
+    for page_num in range(start, stop):
+        if time.monotonic() > deadline:
+            return text_content, page_num - start
+        page = pdf[page_num]
+        textpage = page.get_textpage()
+        text = textpage.get_text_range()
+        textpage.close()
+        page.close()
+        if text and text.strip():
+            text_content.append({
+                'page': page_num + 1,
+                'text': text.strip()
+            })
+    return text_content, stop - start
+
+def extract_text_pypdf2(file_path):
+    """Extract text using the pure-Python PyPDF2 parser."""
+    text_content = []
+    deadline = time.monotonic() + EXTRACT_TIME_BUDGET
+    # PyPDF2 reads many streams a byte at a time; memory-mapping the file turns
+    # those reads into page-cache lookups instead of read() syscalls
+    with open(file_path, 'rb') as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        pdf_reader = PyPDF2.PdfReader(mapped)
+        page_count = len(pdf_reader.pages)
+        pages_read = 0
+        for page_num, page in enumerate(pdf_reader.pages):
+            if time.monotonic() > deadline:
+                break
+            text = page.extract_text()
+            pages_read += 1
+            if text and text.strip():
+                text_content.append({
+                    'page': page_num + 1,
+                    'text': text.strip()
+                })
+    return text_content, page_count, pages_read
 
 def determine_document_type(filename, content):
-    """Determines document type based on filename and content."""
-    filename_lower = filename.lower()
-    content_lower = ' '.join([page['text'] for page in content]).lower()
+    """Determines document type based on filename and content.
+    
+    Classification is currently disabled, so every document is stored without a type.
+    """
+    # filename_lower = filename.lower()
+    # content_lower = ' '.join([page['text'] for page in content]).lower()
     
     # if any(word in filename_lower for word in ['policy', 'policies']):
     #     return 'policy'
@@ -236,51 +569,245 @@ def determine_document_type(filename, content):
     #     return 'guide'
     # else:
     #     return 'document'
+    return None
 
 def process_pdf_background(file_id, file_path, original_filename):
-    """Background task to process PDF content."""
-    conn = get_db()
-    cursor = conn.cursor()
-    
+    """Background task to extract PDF content and hand it to the index writer."""
     try:
         print(f"Processing {original_filename} (ID: {file_id})")
         
-        content, page_count = extract_text_from_pdf(file_path)
+        content, page_count, pages_read = extract_text_from_pdf(file_path)
         
         if not content:
             raise Exception("No text content could be extracted from the PDF")
+        
+        # Pages skipped once the time budget ran out are noted but do not fail the document
+        extraction_note = None
+        if pages_read < page_count:
+            extraction_note = f"Text extraction stopped after {pages_read} of {page_count} pages (time limit reached)"
+            print(f"{original_filename}: {extraction_note}")
             
         doc_type = determine_document_type(original_filename, content)
         
         print(f"Extracted {len(content)} pages from {original_filename}")
         
-        # Store content in FTS5 table
-        for page_data in content:
-            cursor.execute(
-                "INSERT INTO document_content_fts (document_id, page_number, content) VALUES (?, ?, ?)",
-                (file_id, page_data['page'], page_data['text'])
-            )
-        
-        # Update document status
-        cursor.execute(
-            "UPDATE documents SET status = ?, page_count = ?, document_type = ? WHERE id = ?",
-            ('indexed', page_count, doc_type, file_id)
-        )
-        
-        conn.commit()
-        print(f"Successfully processed: {original_filename}")
+        _index_slots.acquire()
+        _write_queue.put((store_document_index, (file_id, original_filename, content, page_count, doc_type, extraction_note)))
         
     except Exception as e:
         error_msg = str(e)
         print(f"Error processing {original_filename}: {error_msg}")
+        _write_queue.put((store_document_error, (file_id, error_msg)))
+
+def store_document_record(conn, file_id, filename, original_filename, file_size, content_hash):
+    """Inserts the record for a newly uploaded document."""
+    conn.execute(
+        "INSERT INTO documents (id, filename, original_name, file_size, status, content_hash) VALUES (?, ?, ?, ?, ?, ?)",
+        (file_id, filename, original_filename, file_size, 'processing', content_hash)
+    )
+
+def store_document_index(conn, file_id, original_filename, content, page_count, doc_type, extraction_note):
+    """Stores a document's extracted pages (indexed by trigger) and marks it as indexed."""
+    updated = conn.execute(
+        "UPDATE documents SET status = ?, page_count = ?, document_type = ?, error_message = ? WHERE id = ?",
+        ('indexed', page_count, doc_type, extraction_note, file_id)
+    ).rowcount
+    # The record may have been cleared, or never stored, while the document was queued
+    if updated == 0:
+        raise Exception(f"Document record {file_id} no longer exists")
+    
+    conn.executemany(
+        "INSERT INTO document_content (document_id, page_number, content) VALUES (?, ?, ?)",
+        ((file_id, page_data['page'], page_data['text']) for page_data in content)
+    )
+    return f"Successfully processed: {original_filename}"
+
+def store_document_error(conn, file_id, error_msg):
+    """Marks a document as failed to process."""
+    conn.execute(
+        "UPDATE documents SET status = ?, error_message = ? WHERE id = ?", 
+        ('error', error_msg, file_id)
+    )
+
+def apply_writes(conn, batch):
+    """Applies a batch of queued writes in a single transaction, rolling it back on any error."""
+    try:
+        # Take the write lock up front so the inserts never have to upgrade a read lock
+        conn.execute("BEGIN IMMEDIATE")
+        messages = [write(conn, *args) for write, args in batch]
+        indexed = sum(1 for write, _ in batch if write is store_document_index)
+        if indexed:
+            # Fold the new segments into existing ones so searches visit fewer of them,
+            # merging in proportion to how many documents the batch indexed
+            conn.execute(
+                "INSERT INTO document_content_fts(document_content_fts, rank) VALUES ('merge', ?)",
+                (FTS_MERGE_PAGES * indexed,)
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    bump_data_version()
+    for message in messages:
+        if message:
+            print(message)
+    if indexed:
+        optimize_search_index(conn, indexed)
+
+def apply_write_alone(conn, write, args):
+    """Applies one queued write, marking its document as failed if it cannot be stored."""
+    try:
+        apply_writes(conn, [(write, args)])
+    except Exception as e:
+        print(f"Index writer error for document {args[0]}: {e}")
+        if write is store_document_index:
+            try:
+                apply_writes(conn, [(store_document_error, (args[0], str(e)))])
+            except Exception as error_e:
+                print(f"Failed to record error for document {args[0]}: {error_e}")
+
+_indexed_since_optimize = 0
+
+def optimize_search_index(conn, documents=1):
+    """Merges the FTS5 index into a single segment once every FTS_OPTIMIZE_EVERY documents."""
+    global _indexed_since_optimize
+    _indexed_since_optimize += documents
+    if _indexed_since_optimize < FTS_OPTIMIZE_EVERY:
+        return
+    _indexed_since_optimize = 0
+    
+    try:
+        conn.execute("INSERT INTO document_content_fts(document_content_fts) VALUES ('optimize')")
+        conn.commit()
+        print("Search index optimized")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Search index optimize failed: {e}")
+
+_last_maintenance = None
+
+def run_maintenance(conn):
+    """Optimizes the search index and refreshes planner statistics once every MAINTENANCE_INTERVAL."""
+    global _last_maintenance, _indexed_since_optimize
+    now = time.monotonic()
+    if _last_maintenance is not None and now - _last_maintenance < MAINTENANCE_INTERVAL:
+        return
+    _last_maintenance = now
+    
+    try:
+        conn.execute("INSERT INTO document_content_fts(document_content_fts) VALUES ('optimize')")
+        conn.execute("ANALYZE")
+        conn.commit()
+        _indexed_since_optimize = 0
+        print("Database maintenance completed")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Database maintenance failed: {e}")
+
+_processing_queue = queue.Queue()
+_write_queue = queue.Queue()
+# Bounds the extracted documents on the write queue, so extraction cannot run far ahead
+# of the writer holding page text in memory; small error writes are not counted
+_index_slots = threading.BoundedSemaphore(WRITE_QUEUE_SIZE)
+_background_workers = {}
+_background_workers_lock = threading.Lock()
+
+def processing_worker():
+    """Drains the processing queue, extracting uploaded PDFs one at a time."""
+    while True:
+        file_id, file_path, original_filename = _processing_queue.get()
+        try:
+            process_pdf_background(file_id, file_path, original_filename)
+        except Exception as e:
+            print(f"Processing worker error for {original_filename}: {e}")
+        finally:
+            _processing_queue.task_done()
+
+def index_writer():
+    """Applies queued writes on one long-lived connection, so background writes never contend for the write lock."""
+    conn = connect_db()
+    while True:
+        try:
+            batch = [_write_queue.get(timeout=SEARCH_LOG_FLUSH_INTERVAL)]
+        except queue.Empty:
+            # Idle: catch up on buffered logs and any maintenance that is due
+            flush_search_logs(conn)
+            run_maintenance(conn)
+            continue
+        
+        # Coalesce everything else already waiting into the same transaction
+        while True:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
         
-        cursor.execute(
-            "UPDATE documents SET status = ?, error_message = ? WHERE id = ?", 
-            ('error', error_msg, file_id)
+        try:
+            if len(batch) == 1:
+                apply_write_alone(conn, *batch[0])
+            else:
+                try:
+                    apply_writes(conn, batch)
+                except Exception as e:
+                    # Retry one at a time so a single bad write cannot fail the others
+                    print(f"Batched write of {len(batch)} items failed, retrying individually: {e}")
+                    for write, args in batch:
+                        apply_write_alone(conn, write, args)
+        finally:
+            for write, _ in batch:
+                if write is store_document_index:
+                    _index_slots.release()
+                _write_queue.task_done()
+        flush_search_logs(conn)
+
+def start_background_workers():
+    """Starts the processing and writer threads, restarting either one if it has died."""
+    with _background_workers_lock:
+        for target in (processing_worker, index_writer):
+            worker = _background_workers.get(target)
+            if worker is None or not worker.is_alive():
+                worker = _background_workers[target] = threading.Thread(target=target, daemon=True)
+                worker.start()
+
+def enqueue_pdf_processing(file_id, file_path, original_filename):
+    """Queues an uploaded PDF for indexing, starting the worker threads on first use."""
+    start_background_workers()
+    _processing_queue.put((file_id, file_path, original_filename))
+
+_search_log_buffer = []
+_search_log_lock = threading.Lock()
+
+def log_search(query, results_count):
+    """Buffers a search log entry; the writer thread stores buffered entries in batches."""
+    # Same format as CURRENT_TIMESTAMP, taken now rather than when the batch is written
+    search_date = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    with _search_log_lock:
+        _search_log_buffer.append((query, results_count, search_date))
+    start_background_workers()
+
+def flush_search_logs(conn):
+    """Writes buffered search log entries in one transaction and trims the oldest rows."""
+    global _search_log_buffer
+    with _search_log_lock:
+        if not _search_log_buffer:
+            return
+        batch, _search_log_buffer = _search_log_buffer, []
+    
+    try:
+        conn.executemany(
+            "INSERT INTO search_logs (query, results_count, search_date) VALUES (?, ?, ?)",
+            batch
+        )
+        # Keep the log bounded to the newest SEARCH_LOG_MAX_ROWS entries
+        conn.execute(
+            "DELETE FROM search_logs WHERE id <= (SELECT MAX(id) FROM search_logs) - ?",
+            (SEARCH_LOG_MAX_ROWS,)
         )
         conn.commit()
-    finally:
-        conn.close()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Failed to log {len(batch)} searches: {e}")
 
 @app.route('/')
 def home():
@@ -2039,6 +2566,11 @@ def home():
     '''
     return html_template
 
+@app.errorhandler(413)
+def file_too_large(error):
+    """Rejects uploads larger than MAX_FILE_SIZE."""
+    return jsonify({'error': f'File too large. Max size is {MAX_FILE_SIZE // (1024 * 1024)}MB'}), 413
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     """Handles file upload and initiates background PDF processing."""
@@ -2052,6 +2584,16 @@ def upload_file():
     if not allowed_file(file.filename):
         return jsonify({'error': 'Only PDF files (.pdf) are allowed'}), 400
     
+    # Reject non-PDF content before anything is written to disk. The header
+    # may be preceded by junk bytes, so the first 1KB is checked.
+    header = file.stream.read(1024)
+    if b'%PDF-' not in header:
+        return jsonify({'error': 'File is not a valid PDF'}), 400
+    file_size = file.stream.seek(0, os.SEEK_END)
+    file.stream.seek(0)
+    if file_size > MAX_FILE_SIZE:
+        return file_too_large(None)
+    
     # Generate unique filename using UUID
     file_id = str(uuid.uuid4())
     original_filename = secure_filename(file.filename)
@@ -2060,20 +2602,33 @@ def upload_file():
     
     try:
         # Save file temporarily
-        file.save(file_path)
-        file_size = os.path.getsize(file_path)
-        
-        if file_size > MAX_FILE_SIZE:
-            os.remove(file_path)
-            return jsonify({'error': f'File too large. Max size is {MAX_FILE_SIZE / (1024 * 1024)}MB'}), 400
+        file.save(file_path, buffer_size=1024 * 1024)
         
         db = get_db()
         cursor = db.cursor()
+        
+        # Identical content that is already indexed is not saved or indexed again. Rows
+        # still 'processing' may have been orphaned by a restart, so re-uploading recovers them.
+        content_hash = hash_file(file_path)
         cursor.execute(
-            "INSERT INTO documents (id, filename, original_name, file_size, status) VALUES (?, ?, ?, ?, ?)",
-            (file_id, unique_filename_on_disk, original_filename, file_size, 'processing')
+            "SELECT id, original_name, file_size, upload_date, status, page_count FROM documents "
+            "WHERE content_hash = ? AND status = 'indexed' LIMIT 1",
+            (content_hash,)
         )
-        db.commit()
+        existing = cursor.fetchone()
+        if existing:
+            os.remove(file_path)
+            print(f"Duplicate upload of {original_filename}; matches document {existing['id']}")
+            return jsonify({
+                'id': existing['id'],
+                'name': existing['original_name'],
+                'size': existing['file_size'],
+                'status': existing['status'],
+                'uploadDate': existing['upload_date'],
+                'pageCount': existing['page_count'] or 0,
+                'storage': 'cloud' if USE_CLOUD_STORAGE else 'local',
+                'duplicate': True
+            }), 200
         
         print(f"File uploaded: {original_filename} (ID: {file_id}, Size: {file_size} bytes)")
         
@@ -2091,13 +2646,15 @@ def upload_file():
                 print(f"Cloud upload failed: {cloud_message}")
                 # Continue with local storage if cloud fails
         
-        # Start background processing for PDF content extraction and indexing
-        thread = threading.Thread(
-            target=process_pdf_background, 
-            args=(file_id, file_path, original_filename)
-        )
-        thread.daemon = True
-        thread.start()
+        # The record is committed here, once nothing else can fail, so a failed insert is
+        # reported to the client instead of leaving the upload without a row. A single-row
+        # insert is cheap under WAL with synchronous=NORMAL.
+        store_document_record(db, file_id, unique_filename_on_disk, original_filename, file_size, content_hash)
+        db.commit()
+        bump_data_version()
+        
+        # Queue the PDF for background content extraction and indexing
+        enqueue_pdf_processing(file_id, file_path, original_filename)
         
         return jsonify({
             'id': file_id,
@@ -2133,220 +2690,157 @@ def search():
     cursor = db.cursor()
     
     try:
-        # First check if we have any indexed documents
-        cursor.execute("SELECT COUNT(*) FROM documents WHERE status = 'indexed'")
-        indexed_count = cursor.fetchone()[0]
-        print(f"Total indexed documents: {indexed_count}")
-        
-        if indexed_count == 0:
-            return jsonify({
-                'query': query,
-                'results': [],
-                'total': 0,
-                'message': 'No documents have been indexed yet. Please upload and wait for documents to be processed.'
-            })
-        
         # Clean the query to prevent FTS5 syntax errors
-        clean_query = re.sub(r'[^\w\s]', ' ', query).strip()
+        if query.isascii():
+            clean_query = query.translate(_NON_WORD_ASCII_TABLE).strip()
+        else:
+            clean_query = _NON_WORD_RE.sub(' ', query).strip()
         if not clean_query:
             return jsonify({'results': [], 'total': 0, 'query': query})
         
         # Filter out only the most common logical words that interfere with search
         logical_words = {'and', 'or', 'the', 'a', 'an'}
         
-        # Split into terms and filter out only the most problematic logical words
-        search_terms = [term.lower() for term in clean_query.split() 
-                       if term.lower() not in logical_words and len(term) >= 2]
+        # Split into terms and filter out only the most problematic logical words.
+        # The query is lowercased once here; matching downstream is case-insensitive.
+        search_terms = [term for term in clean_query.lower().split() 
+                       if term not in logical_words and len(term) >= 2]
         
         if not search_terms:
             return jsonify({'results': [], 'total': 0, 'query': query, 'message': 'No meaningful search terms found after filtering'})
         
         print(f"Filtered search terms: {search_terms}")
         
-        # Create multi-word search patterns
-        # For FTS5: Use AND logic to find documents containing ALL search terms
-        fts_and_patterns = []
-        fts_or_patterns = []
-        
-        for term in search_terms:
-            # Add the original term
-            fts_and_patterns.append(f'"{term}"')
-            fts_or_patterns.append(f'"{term}"')
-            # Add wildcard pattern for partial matching
-            fts_and_patterns.append(f'"{term}*"')
-            fts_or_patterns.append(f'"{term}*"')
-        
-        # Create AND query (all terms must be present) and OR query (any term can be present)
-        fts_and_query = ' AND '.join(fts_and_patterns)
-        fts_or_query = ' OR '.join(fts_or_patterns)
+        # Check for indexed documents only once the query is known to have usable terms
+        # EXISTS stops at the first indexed document instead of counting them all
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM documents WHERE status = 'indexed')")
+        has_indexed = cursor.fetchone()[0]
         
-        print(f"FTS AND query: {fts_and_query}")
-        print(f"FTS OR query: {fts_or_query}")
+        if not has_indexed:
+            return jsonify({
+                'query': query,
+                'results': [],
+                'total': 0,
+                'message': 'No documents have been indexed yet. Please upload and wait for documents to be processed.'
+            })
         
         # Try FTS5 first, then fall back to LIKE queries for partial matching
+        total_matches = None
         try:
-            # Use the selected search mode
-            if search_mode == 'or':
-                # Use OR query for broader results
-                fts_query_to_use = fts_or_query
-                print(f"Using OR search mode: {fts_query_to_use}")
-            else:
-                # Use AND query for more precise results (default)
-                fts_query_to_use = fts_and_query
-                print(f"Using AND search mode: {fts_query_to_use}")
-            
-            if doc_type and doc_type != 'all':
-                fts_query_sql = """
-                    SELECT T.document_id, T.page_number, T.content
-                    FROM document_content_fts AS T 
-                    JOIN documents AS d ON T.document_id = d.id 
-                    WHERE document_content_fts MATCH ? AND d.document_type = ? AND d.status = 'indexed'
-                    LIMIT ?
-                """
-                params = [fts_query_to_use, doc_type, limit]
-            else:
-                fts_query_sql = """
-                    SELECT T.document_id, T.page_number, T.content
+            # AND mode (default) requires every term, OR mode accepts any of them
+            fts_query_to_use = build_match_query(search_terms, search_mode)
+            print(f"Using {'OR' if search_mode == 'or' else 'AND'} search mode: {fts_query_to_use}")
+            
+            # Rank every matching page, keep the best page of each document, and only
+            # then build a highlighted snippet and attach document details for the few
+            # rows that are actually returned
+            type_filter = "AND d.document_type = ?" if doc_type and doc_type != 'all' else ""
+            fts_query_sql = f"""
+                WITH page_matches AS MATERIALIZED (
+                    SELECT T.rowid AS page_rowid, T.document_id, bm25(document_content_fts) AS score
                     FROM document_content_fts AS T 
                     JOIN documents AS d ON T.document_id = d.id 
-                    WHERE document_content_fts MATCH ? AND d.status = 'indexed'
+                    WHERE document_content_fts MATCH ? {type_filter} AND d.status = 'indexed'
+                ),
+                best_pages AS (
+                    SELECT page_rowid, document_id, MIN(score) AS score, COUNT(*) AS hits
+                    FROM page_matches
+                    GROUP BY document_id
+                    ORDER BY score
                     LIMIT ?
-                """
-                params = [fts_query_to_use, limit]
-            
-            cursor.execute(fts_query_sql, params)
+                )
+                SELECT b.document_id, C.page_number,
+                       snippet(C.document_content_fts, 2, '<span class="highlight">', '</span>', '...', 40),
+                       b.score, b.hits, d.original_name, d.upload_date, d.document_type
+                FROM best_pages AS b
+                JOIN document_content_fts AS C
+                  ON C.rowid = b.page_rowid AND C.document_content_fts MATCH ?
+                JOIN documents AS d ON d.id = b.document_id
+                ORDER BY b.score
+            """
+            match_params = [fts_query_to_use] + ([doc_type] if type_filter else [])
+            
+            cursor.execute(fts_query_sql, match_params + [limit, fts_query_to_use])
             fts_matches = cursor.fetchall()
             print(f"FTS query returned {len(fts_matches)} results")
             
+            # A full page of results may not be all of them, so count the matching
+            # documents, stopping after SEARCH_TOTAL_CAP documents to bound the cost
+            if len(fts_matches) == limit:
+                cursor.execute(f"""
+                    SELECT COUNT(*) FROM (
+                        SELECT DISTINCT T.document_id
+                        FROM document_content_fts AS T
+                        JOIN documents AS d ON T.document_id = d.id
+                        WHERE document_content_fts MATCH ? {type_filter} AND d.status = 'indexed'
+                        LIMIT ?
+                    )
+                """, match_params + [SEARCH_TOTAL_CAP])
+                total_matches = cursor.fetchone()[0]
+            
             # If FTS5 returns no results, try LIKE queries for partial matching
             if not fts_matches:
                 print("FTS5 returned no results, trying LIKE queries for partial matching")
+                like_query, like_params = build_like_search(search_terms, search_mode, limit)
+                print(f"Executing LIKE {search_mode.upper()} query with parameters: {like_params}")
                 
-                # Build LIKE query for multi-word search based on search mode
-                like_conditions = []
-                like_params = []
-                
-                for term in search_terms:
-                    like_conditions.append("T.content LIKE ?")
-                    like_params.append(f"%{term}%")
-                
-                if like_conditions:
-                    # Use the selected search mode for LIKE queries
-                    if search_mode == 'or':
-                        like_query = f"""
-                            SELECT T.document_id, T.page_number, T.content
-                            FROM document_content_fts AS T 
-                            JOIN documents AS d ON T.document_id = d.id 
-                            WHERE ({' OR '.join(like_conditions)}) AND d.status = 'indexed'
-                            LIMIT ?
-                        """
-                        print(f"Executing LIKE OR query: {like_query}")
-                    else:
-                        like_query = f"""
-                            SELECT T.document_id, T.page_number, T.content
-                            FROM document_content_fts AS T 
-                            JOIN documents AS d ON T.document_id = d.id 
-                            WHERE ({' AND '.join(like_conditions)}) AND d.status = 'indexed'
-                            LIMIT ?
-                        """
-                        print(f"Executing LIKE AND query: {like_query}")
-                    
-                    like_params.append(limit)
-                    print(f"Parameters: {like_params}")
-                    
-                    cursor.execute(like_query, like_params)
-                    fts_matches = cursor.fetchall()
-                    print(f"LIKE query found {len(fts_matches)} matches")
-        except Exception as e:
-            print(f"FTS5 query failed, using LIKE fallback: {e}")
-            # Fallback to LIKE queries with multi-word support based on search mode
-            like_conditions = []
-            like_params = []
-            
-            for term in search_terms:
-                like_conditions.append("T.content LIKE ?")
-                like_params.append(f"%{term}%")
-            
-            if like_conditions:
-                # Use the selected search mode for LIKE queries
-                if search_mode == 'or':
-                    like_query = f"""
-                        SELECT T.document_id, T.page_number, T.content
-                        FROM document_content_fts AS T 
-                        JOIN documents AS d ON T.document_id = d.id 
-                        WHERE ({' OR '.join(like_conditions)}) AND d.status = 'indexed'
-                        LIMIT ?
-                    """
-                else:
-                    like_query = f"""
-                        SELECT T.document_id, T.page_number, T.content
-                        FROM document_content_fts AS T 
-                        JOIN documents AS d ON T.document_id = d.id 
-                        WHERE ({' AND '.join(like_conditions)}) AND d.status = 'indexed'
-                        LIMIT ?
-                    """
-                
-                like_params.append(limit)
                 cursor.execute(like_query, like_params)
                 fts_matches = cursor.fetchall()
-
-
+                print(f"LIKE query found {len(fts_matches)} matches")
+        except Exception as e:
+            print(f"FTS5 query failed, using LIKE fallback: {e}")
+            like_query, like_params = build_like_search(search_terms, search_mode, limit)
+            cursor.execute(like_query, like_params)
+            fts_matches = cursor.fetchall()
         
         print(f"Found {len(fts_matches)} matches")
         
         results_data = []
+        # Only LIKE fallback rows, which have no bm25 score, are matched and
+        # highlighted in Python; FTS5 rows arrive with their snippet and score
+        terms_pattern = None
+        if fts_matches and fts_matches[0][3] is None:
+            terms_pattern = compile_terms_pattern(tuple(search_terms))
 
         for match in fts_matches:
-            doc_id, page_num, content = match
+            # FTS5 rows carry a ready-made snippet; LIKE fallback rows carry the page text
+            doc_id, page_num, text, score, hits, original_name, upload_date, document_type = match
             
-            # Fetch document details
-            doc_cursor = db.cursor()
-            doc_cursor.execute(
-                "SELECT original_name, upload_date, document_type, page_count FROM documents WHERE id = ? AND status = 'indexed'", 
-                (doc_id,)
-            )
-            doc_details = doc_cursor.fetchone()
+            if score is not None:
+                snippet = text
+                confidence = bm25_confidence(score)
+            else:
+                match_count, first_pos = scan_terms(text, terms_pattern, search_terms)
+                confidence = calculate_confidence(match_count)
+                snippet = create_snippet(text, terms_pattern, first_pos)
 
-            if doc_details:
-                # Create snippet with highlighting
-                snippet = create_snippet(content, search_terms)
-                
-                # Calculate confidence based on term matches
-                confidence = calculate_confidence(content, search_terms)
-
-                result_item = {
-                    'id': doc_id,
-                    'title': doc_details['original_name'].replace('.pdf', ''),
-                    'document': doc_details['original_name'],
-                    'page': page_num, 
-                    'snippet': snippet,
-                    'confidence': confidence,
-                    'type': doc_details['document_type'] or 'document',
-                    'lastUpdated': doc_details['upload_date'],
-                    'filename': doc_details['original_name']
-                }
-                
-                results_data.append(result_item)
-                print(f"Added result: {result_item['title']} (page {page_num}, confidence: {confidence}%)")
+            result_item = {
+                'id': doc_id,
+                'title': original_name.replace('.pdf', ''),
+                'document': original_name,
+                'page': page_num, 
+                'snippet': snippet,
+                'confidence': confidence,
+                'type': document_type or 'document',
+                'lastUpdated': upload_date,
+                'filename': original_name,
+                'matchingPages': hits
+            }
+            
+            results_data.append(result_item)
+            print(f"Added result: {result_item['title']} (page {page_num}, confidence: {confidence}%)")
         
         # Log search
-        try:
-            cursor.execute(
-                "INSERT INTO search_logs (query, results_count) VALUES (?, ?)",
-                (query, len(results_data))
-            )
-            db.commit()
-        except Exception as log_error:
-            print(f"Failed to log search: {log_error}")
+        log_search(query, len(results_data))
         
         response = {
             'query': query,
             'results': results_data,
-            'total': len(results_data)
+            'total': max(total_matches or 0, len(results_data))
         }
         
         print(f"Returning {len(results_data)} results")
-        return jsonify(response)
+        return orjson_response(response)
         
     except sqlite3.OperationalError as e:
         error_msg = str(e)
@@ -2368,23 +2862,65 @@ def search():
         print(f"Search error: {error_msg}")
         return jsonify({'error': f'Search failed: {error_msg}'}), 500
 
-def create_snippet(content, search_terms):
-    """Create a highlighted snippet from content."""
-    if not content or not search_terms:
-        return "No preview available"
+@functools.lru_cache(maxsize=256)
+def compile_terms_pattern(search_terms):
+    """Compile a tuple of search terms into a single case-insensitive alternation pattern."""
+    # Longer terms first so a term is never shadowed by one of its prefixes
+    terms = sorted(set(search_terms), key=len, reverse=True)
+    return re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+
+def scan_terms(content, terms_pattern, search_terms):
+    """Return the number of term matches in content and the position of the first match."""
+    content = content or ''
+    # A single term in ASCII text is found with plain string methods; lowercasing
+    # ASCII never changes the length, so positions in the lowered copy still line up
+    if len(search_terms) == 1 and content.isascii():
+        lowered = content.lower()
+        first_pos = lowered.find(search_terms[0])
+        if first_pos == -1:
+            return 0, None
+        return lowered.count(search_terms[0], first_pos), first_pos
     
-    # Find the first occurrence of any search term
-    content_lower = content.lower()
-    best_pos = len(content)
+    # Both calls run entirely inside the regex engine, with no per-match Python loop
+    first_match = terms_pattern.search(content)
+    if first_match is None:
+        return 0, None
+    match_count = len(terms_pattern.findall(content, first_match.start()))
+    return match_count, first_match.start()
+
+def build_match_query(search_terms, search_mode):
+    """Build an FTS5 MATCH expression with each term as a quoted prefix query."""
+    # A quoted string is always a literal to FTS5, and the * outside the quotes
+    # makes it a prefix query that also matches the whole term
+    patterns = ['"' + term.replace('"', '""') + '"*' for term in search_terms]
+    joiner = ' OR ' if search_mode == 'or' else ' AND '
+    return joiner.join(patterns)
+
+def build_like_search(search_terms, search_mode, limit):
+    """Build the LIKE fallback query, returning the first matching page of each document."""
+    like_conditions = ["T.content LIKE ?" for _ in search_terms]
+    like_params = [f"%{term}%" for term in search_terms]
+    joiner = ' OR ' if search_mode == 'or' else ' AND '
     
-    for term in search_terms:
-        pos = content_lower.find(term.lower())
-        if pos != -1 and pos < best_pos:
-            best_pos = pos
+    like_query = f"""
+        SELECT T.document_id, MIN(T.page_number) AS page_number, T.content, NULL AS score, COUNT(*) AS hits,
+               d.original_name, d.upload_date, d.document_type
+        FROM document_content AS T 
+        JOIN documents AS d ON T.document_id = d.id 
+        WHERE ({joiner.join(like_conditions)}) AND d.status = 'indexed'
+        GROUP BY T.document_id
+        ORDER BY hits DESC, d.upload_date DESC
+        LIMIT ?
+    """
+    return like_query, like_params + [limit]
+
+def create_snippet(content, terms_pattern, first_pos):
+    """Create a highlighted snippet from content around the first term match."""
+    if not content or terms_pattern is None:
+        return "No preview available"
     
     # If no terms found, return beginning
-    if best_pos == len(content):
-        best_pos = 0
+    best_pos = first_pos if first_pos is not None else 0
     
     # Extract snippet around the found position
     start = max(0, best_pos - 100)
@@ -2397,29 +2933,19 @@ def create_snippet(content, search_terms):
     if end < len(content):
         snippet = snippet + "..."
     
-    # Highlight search terms
-    for term in search_terms:
-        pattern = re.compile(re.escape(term), re.IGNORECASE)
-        snippet = pattern.sub(f'<span class="highlight">{term}</span>', snippet)
-    
-    return snippet
+    # Highlight all search terms in one pass
+    return terms_pattern.sub(lambda m: f'<span class="highlight">{m.group(0)}</span>', snippet)
 
-def calculate_confidence(content, search_terms):
+def calculate_confidence(match_count):
     """Calculate search confidence based on term frequency."""
-    if not content or not search_terms:
-        return 50
-    
-    content_lower = content.lower()
-    total_matches = 0
-    
-    for term in search_terms:
-        matches = content_lower.count(term.lower())
-        total_matches += matches
-    
     # Base confidence + bonus for matches
-    confidence = min(100, 60 + (total_matches * 8))
+    confidence = min(100, 60 + (match_count * 8))
     return confidence
 
+def bm25_confidence(score):
+    """Convert an FTS5 bm25 score (lower is better) to a confidence percentage."""
+    return min(100, 60 + int(-score * 8))
+
 @app.route('/api/document/<doc_id>/view', methods=['GET'])
 def view_pdf(doc_id):
     """Serves a PDF document for viewing in the browser."""
@@ -2467,35 +2993,43 @@ def download_pdf(doc_id):
     )
 
 @app.route('/api/documents', methods=['GET'])
+@cached_response()
 def get_documents():
     """Gets metadata for all uploaded documents."""
     db = get_db()
     cursor = db.cursor()
+    # Plain tuples, unpacked by position, avoid building a Row and looking up every field by name
+    cursor.row_factory = None
     cursor.execute("""
         SELECT id, original_name, file_size, upload_date, status, page_count, document_type, error_message
         FROM documents 
         ORDER BY upload_date DESC
     """)
     
-    documents = []
-    for row in cursor.fetchall():
-        doc_data = {
-            'id': row['id'],
-            'name': row['original_name'],
-            'size': row['file_size'],
-            'uploadDate': row['upload_date'],
-            'status': row['status'],
-            'pageCount': row['page_count'],
-            'type': row['document_type']
-        }
-        
-        # Add error message if status is error
-        if row['status'] == 'error' and row['error_message']:
-            doc_data['error'] = row['error_message']
-            
-        documents.append(doc_data)
+    def generate():
+        # Stream rows straight from the cursor instead of building the whole list first
+        yield b'['
+        first = True
+        for doc_id, name, size, upload_date, status, page_count, doc_type, error_message in cursor:
+            doc_data = {
+                'id': doc_id,
+                'name': name,
+                'size': size,
+                'uploadDate': upload_date,
+                'status': status,
+                'pageCount': page_count,
+                'type': doc_type
+            }
+            
+            # Add error message if status is error
+            if status == 'error' and error_message:
+                doc_data['error'] = error_message
+            
+            yield (b'' if first else b',') + orjson.dumps(doc_data)
+            first = False
+        yield b']'
     
-    return jsonify(documents)
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/api/backup', methods=['POST'])
 def create_backup_endpoint():
@@ -2604,52 +3138,44 @@ def get_backup_info():
     })
 
 @app.route('/api/stats', methods=['GET'])
+@cached_response(ttl=5)
 def get_stats():
     """Gets system statistics."""
     db = get_db()
     cursor = db.cursor()
     
-    # Total indexed documents
-    cursor.execute("SELECT COUNT(*) FROM documents WHERE status = 'indexed'")
-    total_docs = cursor.fetchone()[0]
-    
-    # Total pages indexed
-    cursor.execute("SELECT SUM(page_count) FROM documents WHERE status = 'indexed'")
-    total_pages = cursor.fetchone()[0] or 0
-    
-    # Recent searches (last 24 hours)
-    cursor.execute("SELECT COUNT(*) FROM search_logs WHERE search_date >= datetime('now', '-24 hours')")
-    recent_searches_count = cursor.fetchone()[0]
-    
-    # Last update time
-    cursor.execute("SELECT MAX(upload_date) FROM documents WHERE status = 'indexed'")
-    last_updated_ts = cursor.fetchone()[0]
+    # Document totals, recent searches (last 24 hours), last update time and
+    # per-type counts, all gathered in a single statement. The three totals share
+    # one pass over the indexed documents instead of a subquery scan each.
+    cursor.execute("""
+        SELECT
+            COUNT(*) AS total_docs,
+            COALESCE(SUM(page_count), 0) AS total_pages,
+            CAST(strftime('%s', MAX(upload_date)) AS INTEGER) AS last_updated,
+            (SELECT COUNT(*) FROM search_logs WHERE search_date >= datetime('now', '-24 hours')) AS recent_searches,
+            (SELECT json_group_object(doc_type, type_count) FROM (
+                SELECT COALESCE(document_type, 'document') AS doc_type, COUNT(*) AS type_count
+                FROM documents WHERE status = 'indexed' GROUP BY doc_type
+            )) AS document_types
+        FROM documents
+        WHERE status = 'indexed'
+    """)
+    stats = cursor.fetchone()
+    total_docs = stats['total_docs']
+    total_pages = stats['total_pages']
+    recent_searches_count = stats['recent_searches']
+    last_updated_ts = stats['last_updated']
     last_updated_readable = "No documents yet"
     
-    if last_updated_ts:
-        try:
-            dt_object = datetime.fromisoformat(last_updated_ts.replace('Z', '+00:00'))
-            time_diff = datetime.now() - dt_object
-            
-            if time_diff.total_seconds() < 60:
-                last_updated_readable = "just now"
-            elif time_diff.total_seconds() < 3600:
-                minutes = int(time_diff.total_seconds() / 60)
-                last_updated_readable = f"{minutes} minutes ago"
-            elif time_diff.total_seconds() < 86400:
-                hours = int(time_diff.total_seconds() / 3600)
-                last_updated_readable = f"{hours} hours ago"
-            else:
-                days = int(time_diff.total_seconds() / 86400)
-                last_updated_readable = f"{days} days ago"
-        except:
-            last_updated_readable = "recently"
-
-    # Document types
-    cursor.execute("SELECT document_type, COUNT(*) FROM documents WHERE status = 'indexed' GROUP BY document_type")
-    doc_types = dict(cursor.fetchall())
+    # upload_date is stored in UTC, so the epoch seconds compare directly with time.time()
+    if last_updated_ts is not None:
+        last_updated_readable = format_age(int(time.time()) - last_updated_ts)
+    elif total_docs:
+        last_updated_readable = "recently"
+
+    doc_types = json.loads(stats['document_types'])
     
-    return jsonify({
+    return orjson_response({
         'totalDocuments': total_docs,
         'totalPages': total_pages,
         'recentSearches': recent_searches_count,
@@ -2658,6 +3184,15 @@ def get_stats():
         'accuracy': 95.0
     })
 
+_AGE_UNITS = ((86400, 'days'), (3600, 'hours'), (60, 'minutes'))
+
+def format_age(seconds):
+    """Formats an age in seconds as a rough 'N units ago' string."""
+    for unit_seconds, unit in _AGE_UNITS:
+        if seconds >= unit_seconds:
+            return f"{seconds // unit_seconds} {unit} ago"
+    return "just now"
+
 @app.route('/api/clear-all', methods=['POST'])
 def clear_all_documents():
     """Clears all documents, indexes, and files from the system."""
@@ -2681,13 +3216,14 @@ def clear_all_documents():
         
         # Clear all tables
         cursor.execute("DELETE FROM documents")
-        cursor.execute("DELETE FROM document_content_fts")
+        cursor.execute("DELETE FROM document_content")
         cursor.execute("DELETE FROM search_logs")
         
         # Reset auto-increment counters
-        cursor.execute("DELETE FROM sqlite_sequence WHERE name IN ('documents', 'document_content_fts', 'search_logs')")
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name IN ('documents', 'document_content', 'search_logs')")
         
         db.commit()
+        bump_data_version()
         
         print("All documents and data cleared successfully")
         
@@ -2713,6 +3249,12 @@ if __name__ == '__main__':
     
     init_database()
     
+    # Start the background threads now so startup maintenance runs before the first upload.
+    # The reloader runs this block in its watcher process too, which never serves requests,
+    # so only the serving child starts them; otherwise they start lazily on first use.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
+    
     # Clean up old backups on startup
     if ENABLE_BACKUPS:
         cleanup_old_backups()